@@ -7,18 +7,41 @@ Generate a stacked-bar response-times chart using QuickChart (no local chart dep
 - Produces:
   - metrics/stacked-times-quickchart.png   (downloaded from QuickChart)
   - metrics/stacked-times-quickchart.html  (interactive Chart.js HTML using CDN)
+- By default charts the most recent runs (--points, or --days worth); --downsample
+  instead summarizes the whole history (M4: first/last/min/max run per time bin) in
+  up to --max-points runs. It is opt-in because it changes what the chart shows.
+- PNGs are cached by chart config hash in --cache-dir. --skip-png writes only the HTML
+  (no QuickChart call); --png-only-if-changed leaves --out-png alone when the chart
+  matches a cached render. Builds that are not published (e.g. PR builds) should pass
+  --skip-png; only builds that publish the charts need the PNG.
 
 Usage:
   python3 scripts/generate-stacked-times-quickchart.py --points 500 --out-png metrics/stacked-times-quickchart.png --out-html metrics/stacked-times-quickchart.html
 """
 import csv
+import filecmp
+import hashlib
 import json
 import os
+import re
 import sys
+import zlib
 import argparse
-from urllib import request, parse, error
+import base64
+import shutil
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from http import client
+from urllib import parse, request
 from datetime import datetime, timezone, timedelta
 
+try:
+    import orjson  # optional: much faster JSON encoding, falls back to the stdlib
+except ImportError:
+    orjson = None
+
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument("--csv", default="metrics/metrics.csv")
@@ -28,28 +51,169 @@ def parse_args():
     p.add_argument("--out-png", default="metrics/stacked-times-quickchart.png")
     p.add_argument("--out-html", default="metrics/stacked-times-quickchart.html")
     p.add_argument("--quickchart-url", default="https://quickchart.io")
+    p.add_argument("--cache-dir", default="metrics/.qc_cache",
+                   help="directory of PNGs keyed by chart config hash; reused instead of calling QuickChart")
+    p.add_argument("--skip-png", action="store_true",
+                   help="only write the interactive HTML; do not render the PNG")
+    p.add_argument("--png-only-if-changed", action="store_true",
+                   help="do not write --out-png when the chart matches a cached render")
     p.add_argument("--max-points", type=int, default=800)
+    p.add_argument("--downsample", action="store_true",
+                   help="summarize the whole CSV history with M4 downsampling (up to --max-points runs) instead of the last N runs")
     return p.parse_args()
 
-def read_csv(path):
-    if not os.path.exists(path):
-        return None, None
-    with open(path, newline="", encoding="utf8") as fh:
-        reader = csv.reader(fh)
-        rows = list(reader)
-    if len(rows) < 2:
-        return None, None
-    header = [h.strip() for h in rows[0]]
-    data = [[c.strip() for c in r] for r in rows[1:] if any(c.strip() for c in r)]
-    return header, data
+def read_csv(path, tail_lines=None):
+    # stream the file: yields the stripped header first, then raw data rows;
+    # with tail_lines, only the last tail_lines lines are read, by seeking
+    # back from the end of the file, so the cost no longer grows with its size
+    if tail_lines is None:
+        with open(path, newline="", encoding="utf8") as fh:
+            reader = csv.reader(fh)
+            header = next(reader, None)
+            if header is None:
+                return
+            yield [h.strip() for h in header]
+            yield from reader
+        return
+    with open(path, "rb") as fh:
+        header = next(csv.reader([fh.readline().decode("utf8")]), None)
+        if header is None:
+            return
+        yield [h.strip() for h in header]
+        yield from csv.reader(read_last_lines(fh, tail_lines))
+
+def read_last_lines(fh, n, block=1 << 16):
+    # last n lines after the current position of binary file fh, read backwards in blocks
+    start = fh.tell()
+    pos = fh.seek(0, os.SEEK_END)
+    chunk = b""
+    while pos > start and chunk.count(b"\n") <= n:
+        step = min(block, pos - start)
+        pos -= step
+        fh.seek(pos)
+        chunk = fh.read(step) + chunk
+    lines = chunk.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    if pos > start:
+        lines.pop(0)  # partial line at the block boundary
+    return [line.decode("utf8") for line in lines[-n:]] if n > 0 else []
+
+# UTC timestamps as written by metrics.js (Date.toISOString), e.g. 2024-05-01T12:00:00.123Z
+_UTC_ISO_RE = re.compile(r"(\d{4}-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2}))(?:\.(\d{1,6}))?(?:Z|\+00:00)")
 
 def iso_or_empty(s):
+    # fast path for UTC input: normalize the string directly, producing the
+    # same text as datetime.isoformat() without building a datetime per row.
+    # Only fields that are valid in every month take it (day <= 28); anything
+    # else goes through datetime, which rejects impossible dates
+    m = _UTC_ISO_RE.fullmatch(s)
+    if m and ("01" <= m.group(2) <= "12" and "01" <= m.group(3) <= "28"
+              and m.group(4) <= "23" and m.group(5) <= "59" and m.group(6) <= "59"):
+        frac = (m.group(7) or "").ljust(6, "0")
+        if frac == "000000":
+            return m.group(1) + "+00:00"
+        return f"{m.group(1)}.{frac}+00:00"
     try:
         d = datetime.fromisoformat(s.replace("Z", "+00:00"))
         return d.astimezone(timezone.utc).isoformat()
     except Exception:
         return ""
 
+def downsample_m4(stamped, n_buckets, height):
+    """M4-downsample (ts, row) pairs into at most n_buckets time bins.
+
+    Each bin keeps its first, last, lowest and highest row (by height(row)),
+    so spikes survive.  Bin widths are powers of two seconds; whenever there
+    are too many bins the width doubles and adjacent bins are merged, which
+    keeps memory bounded while streaming.  Because of the doubling, the final
+    bin count lands between about n_buckets/2 and n_buckets, so up to (not
+    exactly) 4 * n_buckets rows are returned.  Input need not be time-ordered:
+    first/last are by timestamp and rows are returned in timestamp order.
+    Returns (rows, total_rows).
+    """
+    shift = 0
+    bins = {}
+    total = 0
+    for ts, r in stamped:
+        try:
+            t = datetime.fromisoformat(ts).timestamp()
+        except ValueError:
+            continue  # not a usable timestamp; iso_or_empty should not let these through
+        h = height(r)
+        # (timestamp, file index) orders items in time, ties broken by file order
+        item = (t, total, ts, r)
+        total += 1
+        key = int(t) >> shift
+        b = bins.get(key)
+        if b is None:
+            bins[key] = [item, item, (h, item), (h, item)]
+            while len(bins) > n_buckets:
+                shift += 1
+                merged = {}
+                for k, b in bins.items():
+                    m = merged.get(k >> 1)
+                    if m is None:
+                        merged[k >> 1] = b
+                    else:
+                        m[0] = min(m[0], b[0], key=lambda x: x[:2])
+                        m[1] = max(m[1], b[1], key=lambda x: x[:2])
+                        m[2] = min(m[2], b[2], key=lambda x: x[0])
+                        m[3] = max(m[3], b[3], key=lambda x: x[0])
+                bins = merged
+        else:
+            if item[:2] < b[0][:2]:
+                b[0] = item
+            if item[:2] > b[1][:2]:
+                b[1] = item
+            if h < b[2][0]:
+                b[2] = (h, item)
+            if h > b[3][0]:
+                b[3] = (h, item)
+    out = []
+    for key in sorted(bins):
+        # emit the distinct rows of the bin in timestamp order
+        first, last, lo, hi = bins[key]
+        picked = {first[1]: first, last[1]: last, lo[1][1]: lo[1], hi[1][1]: hi[1]}
+        out.extend((ts, r) for _, _, ts, r in sorted(picked.values(), key=lambda x: x[:2]))
+    return out, total
+
+def is_total_column(h):
+    return "total" in h.casefold()
+
+def to_ms(raw):
+    try:
+        return float(raw)
+    except ValueError:
+        return 0.0
+
+def to_json(obj, indent=False):
+    # JSON as UTF-8 bytes: compact, or indented by 2 spaces for humans
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, indent=2).encode("utf8")
+    return json.dumps(obj, separators=(",", ":")).encode("utf8")
+
+def iter_payload_json(payload):
+    # compact JSON of a QuickChart payload in pieces, one chart dataset at a
+    # time, so the full body is never built in memory
+    chart = payload["chart"]
+    skeleton = dict(payload, chart=dict(chart, data=dict(chart["data"], datasets=[])))
+    head, _, tail = to_json(skeleton).partition(b'"datasets":[]')
+    yield head + b'"datasets":['
+    for i, ds in enumerate(chart["data"]["datasets"]):
+        yield (b"," if i else b"") + to_json(ds)
+    yield b"]" + tail
+
+def gzip_chunks(chunks, level=6):
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
 def choose_colors(n):
     base = [
         "#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd","#8c564b",
@@ -92,29 +256,143 @@ def build_chart_config(labels, datasets, title):
     }
     return config
 
-def post_quickchart_png(qurl, chart_config, width=1400, height=700, timeout=30):
-    # POST to /chart with JSON body to get PNG bytes
-    url = qurl.rstrip("/") + "/chart"
+# keep-alive connections reused across QuickChart requests, keyed by (scheme, host)
+_CONNECTIONS = {}
+
+def _proxy_for(scheme, netloc):
+    # proxy netloc from HTTP(S)_PROXY / NO_PROXY, as urllib.request.urlopen would use
+    proxy = request.getproxies().get(scheme)
+    if not proxy or request.proxy_bypass(parse.urlsplit("//" + netloc).hostname or ""):
+        return None
+    return parse.urlsplit(proxy if "://" in proxy else "http://" + proxy).netloc
+
+def _connection(scheme, netloc, timeout):
+    conn = _CONNECTIONS.get((scheme, netloc))
+    if conn is None:
+        proxy = _proxy_for(scheme, netloc)
+        if scheme == "https":
+            # through a proxy: CONNECT tunnel to the target, then TLS inside it
+            conn = client.HTTPSConnection(proxy or netloc, timeout=timeout)
+            if proxy:
+                conn.set_tunnel(netloc)
+        else:
+            conn = client.HTTPConnection(proxy or netloc, timeout=timeout)
+        conn.via_proxy = bool(proxy)
+        _CONNECTIONS[(scheme, netloc)] = conn
+    conn.timeout = timeout
+    return conn
+
+def _drop_connection(scheme, netloc):
+    conn = _CONNECTIONS.pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+def post_quickchart_png(qurl, chart_config, out_path, width=1400, height=700, timeout=30):
+    # POST to /chart with JSON body; the PNG response is streamed to out_path
+    url = parse.urlsplit(qurl.rstrip("/") + "/chart")
     payload = {
         "chart": chart_config,
         "width": width,
         "height": height,
         "format": "png"
     }
-    data = json.dumps(payload).encode("utf8")
-    req = request.Request(url, data=data, headers={"Content-Type":"application/json"})
+    # the JSON body is highly repetitive, so gzip it to cut upload time; it is
+    # encoded and compressed as it is sent (chunked transfer encoding)
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    for attempt in (1, 2):
+        conn = _connection(url.scheme, url.netloc, timeout)
+        try:
+            body = gzip_chunks(iter_payload_json(payload))
+            # a plain-http proxy needs the absolute URL as the request target
+            target = url.geturl() if conn.via_proxy and url.scheme == "http" else url.path
+            conn.request("POST", target, body=body, headers=headers, encode_chunked=True)
+            resp = conn.getresponse()
+            break
+        except ConnectionError:
+            # the server dropped an idle keep-alive connection; reconnect once
+            _drop_connection(url.scheme, url.netloc)
+            if attempt == 2:
+                raise
+    if resp.status != 200:
+        # redirects are not followed: a POST cannot safely be replayed elsewhere.
+        # Include the target and the response body for debugging
+        body = resp.read()
+        location = resp.getheader("Location")
+        moved = f" (redirect to {location})" if location else ""
+        raise RuntimeError(f"QuickChart HTTP error: {resp.status} {resp.reason}{moved} {body.decode('utf8', errors='ignore')}")
     try:
-        with request.urlopen(req, timeout=timeout) as resp:
-            return resp.read()
-    except error.HTTPError as e:
-        # include response body if available for debugging
-        body = e.read().decode("utf8", errors="ignore") if hasattr(e, 'read') else ""
-        raise RuntimeError(f"QuickChart HTTP error: {e.code} {e.reason} {body}")
+        with open(out_path, "wb") as fh:
+            shutil.copyfileobj(resp, fh, 1 << 16)
+    except BaseException:
+        # the response may be partly unread, so the connection cannot be reused
+        _drop_connection(url.scheme, url.netloc)
+        raise
 
-def make_interactive_html(chart_config, outpath, title):
-    # HTML embeds Chart.js from CDN and uses the same config
-    config_json = json.dumps(chart_config, indent=2)
-    html = f"""<!doctype html>
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# renders kept in the PNG cache; older ones are pruned so the cache (which CI
+# saves and restores every run) does not grow without bound
+CACHE_KEEP = 8
+
+def prune_cache(cache_dir, keep=CACHE_KEEP):
+    # drop all but the `keep` most recently used PNGs
+    entries = [e for e in os.scandir(cache_dir) if e.name.endswith(".png") and e.is_file()]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for e in entries[keep:]:
+        os.remove(e.path)
+
+def link_or_copy(src, dst):
+    # hardlink when possible, else copy; dst is replaced atomically and never
+    # written in place, so files sharing a link with it are left untouched
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp = dst + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def fetch_png(qurl, chart_config, out_path, cache_dir, width=1400, height=700, only_if_changed=False):
+    # returns "fetched" (rendered by QuickChart), "cached" (copied from the cache)
+    # or "unchanged": with only_if_changed, a cache hit leaves out_path alone
+    # when it already holds the cached render
+    canon = json.dumps({"chart": chart_config, "width": width, "height": height},
+                       sort_keys=True, separators=(",", ":"))
+    key = hashlib.blake2b(canon.encode("utf8"), digest_size=16).hexdigest()
+    cached = os.path.join(cache_dir, key + ".png")
+    if os.path.exists(cached):
+        os.utime(cached)  # mark as recently used for prune_cache
+        if only_if_changed and os.path.exists(out_path) and (
+                os.path.samefile(cached, out_path) or filecmp.cmp(cached, out_path, shallow=False)):
+            return "unchanged"
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        link_or_copy(cached, out_path)
+        return "cached"
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp = out_path + ".tmp"
+    try:
+        post_quickchart_png(qurl, chart_config, tmp, width, height)
+        # never publish or cache anything that is not actually a PNG
+        with open(tmp, "rb") as fh:
+            head = fh.read(len(PNG_MAGIC))
+        if head != PNG_MAGIC:
+            raise RuntimeError(f"QuickChart response is not a PNG: {head!r}")
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, out_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    link_or_copy(out_path, cached)
+    prune_cache(cache_dir)
+    return "fetched"
+
+# interactive HTML page, split around the (possibly large) chart config so the
+# config bytes go straight to the file rather than into one big formatted string
+HTML_HEAD = """<!doctype html>
 <html>
 <head>
   <meta charset="utf-8"/>
@@ -128,7 +406,14 @@ def make_interactive_html(chart_config, outpath, title):
   <script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
   <script src="https://cdn.jsdelivr.net/npm/chartjs-plugin-zoom@2.0.1/dist/chartjs-plugin-zoom.min.js"></script>
   <script>
-    const cfg = {config_json};
+    const cfg = """
+HTML_TAIL = """;
+    // dataset values are embedded as base64 little-endian float32
+    for (const ds of cfg.data.datasets) {
+      if (typeof ds.data === 'string') {
+        ds.data = new Float32Array(Uint8Array.from(atob(ds.data), c => c.charCodeAt(0)).buffer);
+      }
+    }
     Chart.register(ChartZoom);
     const ctx = document.getElementById('chart').getContext('2d');
     const chart = new Chart(ctx, cfg);
@@ -136,13 +421,34 @@ def make_interactive_html(chart_config, outpath, title):
   </script>
 </body>
 </html>"""
+
+def pack_float32(values):
+    # base64 of the values as little-endian float32, decoded into a Float32Array by the page
+    a = array("f", values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return base64.b64encode(a.tobytes()).decode("ascii")
+
+def make_interactive_html(chart_config, outpath, title):
+    # HTML embeds Chart.js from CDN and uses the same config, with the data
+    # arrays packed as float32 (smaller page, no per-value parsing in the browser)
+    data = chart_config["data"]
+    packed = [dict(ds, data=pack_float32(ds["data"])) for ds in data["datasets"]]
+    config_json = to_json(dict(chart_config, data=dict(data, datasets=packed)), indent=True)
     os.makedirs(os.path.dirname(outpath) or ".", exist_ok=True)
-    with open(outpath, "w", encoding="utf8") as fh:
-        fh.write(html)
+    with open(outpath, "wb", buffering=1 << 20) as fh:
+        fh.write(HTML_HEAD.format(title=title).encode("utf8"))
+        fh.write(config_json)
+        fh.write(HTML_TAIL.encode("utf8"))
 
 def main():
     args = parse_args()
-    header, rows = read_csv(args.csv)
+    header = None
+    if os.path.exists(args.csv):
+        # only the header here; the rows are read below, once we know what to keep
+        rows = read_csv(args.csv)
+        header = next(rows, None)
+        rows.close()
     if header is None:
         print(f"CSV not found or empty at {args.csv}", file=sys.stderr)
         sys.exit(1)
@@ -150,47 +456,70 @@ def main():
     # detect timestamp column = first column
     ts_col = 0
     # detect timing columns: header endswith Time or contains 'total'
-    timing_cols = [(i,h) for i,h in enumerate(header) if i!=ts_col and (h.endswith("Time") or "total" in h.lower())]
+    is_total = [is_total_column(h) for h in header]
+    timing_cols = [(i,h) for i,h in enumerate(header) if i!=ts_col and (is_total[i] or h.endswith("Time"))]
     if not timing_cols:
         print("No timing columns detected in CSV header:", header, file=sys.stderr)
         sys.exit(1)
-
-    # build records with iso timestamp and numeric ms values
-    records = []
-    for r in rows:
-        ts = iso_or_empty(r[ts_col]) if len(r)>ts_col else ""
-        if not ts:
-            continue
-        vals = {}
-        for i,h in timing_cols:
-            raw = r[i] if i < len(r) else "0"
-            try:
-                num = float(raw)
-            except Exception:
-                num = 0.0
-            vals[h] = num
-        records.append((ts, vals))
-
-    if not records:
-        print("No valid rows with timestamps found", file=sys.stderr)
-        sys.exit(1)
+    # position of the total column among the timing columns, if any
+    total_pos = next((j for j,(i,h) in enumerate(timing_cols) if is_total[i]), None)
 
     # decide points
     if args.points and args.points > 0:
-        points = min(args.points, len(records))
+        points_cap = args.points
+    elif args.downsample:
+        points_cap = args.max_points
     else:
         expected_per_day = round(1440 / max(1, args.interval))
-        points = min(args.max_points, expected_per_day * max(1, args.days), len(records))
+        points_cap = min(args.max_points, expected_per_day * max(1, args.days))
 
-    slice_records = records[-points:]
-    labels = [r[0] for r in slice_records]
+    # only the timing fields of a row are kept, picked at C level; short rows
+    # are padded with "" which parses as 0
+    timing_idx = [i for i,h in timing_cols]
+    pick = itemgetter(*timing_idx) if len(timing_idx) > 1 else (lambda r, i=timing_idx[0]: (r[i],))
+    width = max(timing_idx) + 1
+    def project(r):
+        return pick(r if len(r) >= width else r + [""] * (width - len(r)))
+
+    def stamped(rows):
+        # (timestamp, raw timing fields) of the rows with a valid timestamp, in file order
+        next(rows, None)  # header
+        return ((ts, project(r)) for r in rows
+                for ts in [iso_or_empty(r[ts_col].strip()) if len(r)>ts_col else ""] if ts)
+
+    if args.downsample:
+        # bar height = total column if present, else the sum of the timing columns
+        height_pos = [total_pos] if total_pos is not None else range(len(timing_cols))
+        def height(f):
+            return sum(to_ms(f[j]) for j in height_pos)
+        tail, total_runs = downsample_m4(stamped(read_csv(args.csv)), max(1, points_cap // 4), height)
+    else:
+        # read just the end of the file, with some slack for blank or invalid lines
+        cap = max(1, points_cap)
+        tail = deque(stamped(read_csv(args.csv, cap + cap // 8 + 16)), maxlen=cap)
+        if len(tail) < cap:
+            # the file is short or the slack was not enough: stream it all,
+            # still keeping only the most recent cap rows in memory
+            tail = deque(stamped(read_csv(args.csv)), maxlen=cap)
+
+    if not tail:
+        print("No valid rows with timestamps found", file=sys.stderr)
+        sys.exit(1)
+
+    # numeric ms values are only parsed for the rows that will be rendered;
+    # the raw fields are transposed first so each column is converted
+    # straight into a compact array, in timing column order
+    labels = [ts for ts, f in tail]
+    columns = [array("d", map(to_ms, raw)) for raw in zip(*(f for ts, f in tail))]
+    points = len(labels)
 
     # build all datasets (including total if present)
     cols = [h for i,h in timing_cols]
     colors = choose_colors(len(cols))
     all_datasets = []
     for idx,col in enumerate(cols):
-        data = [r[1].get(col, 0) for r in slice_records]
+        # 2 decimals of a millisecond is plenty for rendering and keeps the payload small
+        data = [round(v, 2) for v in columns[idx]]
         ds = {
             "label": col,
             "data": data,
@@ -202,10 +531,9 @@ def main():
         all_datasets.append(ds)
 
     # Separate the total dataset (case-insensitive 'total' in label), exclude it from stacked bars
-    total_idx = next((i for i,d in enumerate(all_datasets) if "total" in d["label"].lower()), None)
     total_dataset = None
-    if total_idx is not None:
-        td = all_datasets.pop(total_idx)
+    if total_pos is not None:
+        td = all_datasets.pop(total_pos)
         # make an overlaid line dataset for total
         total_dataset = {
             "label": td["label"],
@@ -227,25 +555,36 @@ def main():
     if total_dataset is not None:
         render_datasets.append(total_dataset)
 
-    title = f"Per-run elapsed times (stacked) — last {points} runs — unit: ms"
+    if args.downsample:
+        title = f"Per-run elapsed times (stacked) — M4 summary of {total_runs} runs ({points} shown) — unit: ms"
+    else:
+        title = f"Per-run elapsed times (stacked) — last {points} runs — unit: ms"
     chart_config = build_chart_config(labels, render_datasets, title)
 
-    # generate PNG via QuickChart
-    print("Posting chart config to QuickChart...")
-    try:
-        png_bytes = post_quickchart_png(args.quickchart_url, chart_config)
-        os.makedirs(os.path.dirname(args.out_png) or ".", exist_ok=True)
-        with open(args.out_png, "wb") as fh:
-            fh.write(png_bytes)
-        print("Wrote PNG:", args.out_png)
-    except Exception as e:
-        print("Failed to fetch PNG from QuickChart:", e, file=sys.stderr)
-        # still try to write HTML for interactive inspection
-    try:
-        make_interactive_html(chart_config, args.out_html, title)
-        print("Wrote interactive HTML:", args.out_html)
-    except Exception as e:
-        print("Failed to write interactive HTML:", e, file=sys.stderr)
+    # generate PNG via QuickChart in the background; the network round-trip
+    # overlaps with writing the interactive HTML locally
+    png_fut = None
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        if not args.skip_png:
+            print("Posting chart config to QuickChart...")
+            png_fut = ex.submit(fetch_png, args.quickchart_url, chart_config, args.out_png, args.cache_dir,
+                                only_if_changed=args.png_only_if_changed)
+        try:
+            make_interactive_html(chart_config, args.out_html, title)
+            print("Wrote interactive HTML:", args.out_html)
+        except Exception as e:
+            print("Failed to write interactive HTML:", e, file=sys.stderr)
+        if png_fut is None:
+            print("Skipped PNG (--skip-png)")
+            return
+        try:
+            status = png_fut.result()
+            if status == "unchanged":
+                print("PNG unchanged since last render, not written:", args.out_png)
+            else:
+                print("Wrote PNG:", args.out_png + (" (cached)" if status == "cached" else ""))
+        except Exception as e:
+            print("Failed to fetch PNG from QuickChart:", e, file=sys.stderr)
 
 if __name__ == "__main__":
     main()